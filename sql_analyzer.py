@@ -21,22 +21,93 @@ import time
 import re
 import json
 import sys
-from collections import defaultdict, namedtuple
+import functools
+import importlib.util
+import weakref
+from collections import defaultdict
 
-# Try to use sqlparse for better parsing
+# Try to use sqlparse for better parsing (only located here; imported on first use)
+HAS_SQLPARSE = importlib.util.find_spec("sqlparse") is not None
+
+# numpy (optional) speeds up sample data generation
 try:
-    import sqlparse
-    HAS_SQLPARSE = True
+    import numpy as np
+    HAS_NUMPY = True
 except Exception:
-    HAS_SQLPARSE = False
+    HAS_NUMPY = False
 
-Step = namedtuple("Step", ["name", "type", "duration_s", "detail"])
+# orjson (optional) for faster report serialization
+try:
+    import orjson
+    HAS_ORJSON = True
+except Exception:
+    HAS_ORJSON = False
+
+# Precompiled parsing patterns (shared by the helpers below)
+_JOIN_RE = re.compile(r'\bJOIN\b', re.IGNORECASE)
+_SUBQ_RE = re.compile(r'\(\s*SELECT\b', re.IGNORECASE)
+_FROM_RE = re.compile(r'\bFROM\s+([^\s,;]+)', re.IGNORECASE)
+_JOIN_TBL_RE = re.compile(r'\bJOIN\s+([^\s,;]+)', re.IGNORECASE)
+_ALIAS_SPLIT_RE = re.compile(r'\s+AS\s+|\s+', re.IGNORECASE)
+_TRAILING_COMMA_RE = re.compile(r',$')
+_OUTER_PARENS_RE = re.compile(r'^\s*\(|\)\s*$')
+
+# Above this many tables the O(N^2) pairwise join probes are sampled instead
+MAX_PAIRWISE_TABLES = 6
+
+# PRAGMA foreign_key_list results: conn -> (schema versions, {table_name: fks})
+_fk_cache: "weakref.WeakKeyDictionary[sqlite3.Connection, tuple[int, dict]]" = weakref.WeakKeyDictionary()
+
+# EXPLAIN QUERY PLAN results: conn -> (schema versions, {sql: rows}), at most _EXPLAIN_CACHE_SIZE plans per connection
+_explain_cache: "weakref.WeakKeyDictionary[sqlite3.Connection, tuple[int, dict]]" = weakref.WeakKeyDictionary()
+_EXPLAIN_CACHE_SIZE = 128
+
+class AnalyzerConnection(sqlite3.Connection):
+    """sqlite3 connection that can be weakly referenced, so per-connection caches don't keep it alive."""
+
+def _schema_versions(conn):
+    """Return ((schema, schema_version), ...) for every schema on conn: main, temp and ATTACHed ones."""
+    versions = []
+    for _, name, _ in conn.execute("PRAGMA database_list").fetchall():
+        quoted = '"' + name.replace('"', '""') + '"'
+        versions.append((name, conn.execute(f"PRAGMA {quoted}.schema_version").fetchone()[0]))
+    return tuple(versions)
+
+def _conn_cache(cache, conn):
+    """
+    Return conn's dict in cache (a WeakKeyDictionary), emptied whenever any of conn's
+    schemas has changed since it was filled (schema_version bumps on any DDL, and
+    creating temp or attaching a database adds a schema).
+    Connections that can't be weakly referenced get a fresh, uncached dict each call.
+    """
+    version = _schema_versions(conn)
+    try:
+        entry = cache.get(conn)
+    except TypeError:
+        return {}
+    if entry is None or entry[0] != version:
+        entry = (version, {})
+        cache[conn] = entry
+    return entry[1]
 
 # ----------------------
 # Utility: Database Setup
 # ----------------------
+def connect_db(path=":memory:", **kwargs):
+    """
+    Open a SQLite connection tuned for the throwaway sample DB: durability is traded
+    for fast bulk loading. Extra kwargs are passed through to sqlite3.connect.
+    """
+    kwargs.setdefault("factory", AnalyzerConnection)
+    conn = sqlite3.connect(path, **kwargs)
+    conn.execute("PRAGMA journal_mode=MEMORY")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
 def create_sample_db(conn):
     """Create sample tables and populate with synthetic data for simulation."""
+    invalidate_schema_cache(conn)
     cur = conn.cursor()
     cur.executescript("""
     DROP TABLE IF EXISTS customers;
@@ -74,68 +145,90 @@ def create_sample_db(conn):
         FOREIGN KEY(product_id) REFERENCES products(product_id)
     );
     """)
-    # Insert moderate amount of data
-    # customers
-    customers = [(i, f'Cust_{i}', 'City_'+str((i%10)+1)) for i in range(1, 201)]
-    cur.executemany("INSERT INTO customers(customer_id, name, city) VALUES (?, ?, ?);", customers)
-    # products
-    products = [(i, f'Prod_{i}', round(5.0 + (i % 20) * 1.5, 2)) for i in range(1, 501)]
-    cur.executemany("INSERT INTO products(product_id, name, price) VALUES (?, ?, ?);", products)
-    # orders
-    orders = []
-    oid = 1
-    for cust in range(1, 201):
-        # each customer has 1..5 orders
-        for j in range((cust % 5) + 1):
-            orders.append((oid, cust, f'2025-11-{(j%28)+1:02d}', 0.0))
-            oid += 1
-    cur.executemany("INSERT INTO orders(order_id, customer_id, order_date, total) VALUES (?, ?, ?, ?);", orders)
-    # order_items
-    order_items = []
-    oitem_id = 1
-    import random
-    random.seed(42)
-    for order in range(1, oid):
-        # each order has 1..6 items
-        for k in range(1, (order % 6) + 1):
-            pid = random.randint(1, 500)
-            qty = random.randint(1, 5)
-            price = 5.0 + (pid % 20) * 1.5
-            order_items.append((oitem_id, order, pid, qty, price))
-            oitem_id += 1
-    cur.executemany("INSERT INTO order_items(order_item_id, order_id, product_id, quantity, unit_price) VALUES (?, ?, ?, ?, ?);", order_items)
-
-    # update orders.total
-    cur.execute("""
-        UPDATE orders
-        SET total = (
-            SELECT SUM(quantity * unit_price) FROM order_items WHERE order_items.order_id = orders.order_id
-        )
-    """)
-    conn.commit()
+    # populate in a single transaction: commits once, rolls back on failure
+    with conn:
+        # Insert moderate amount of data
+        # customers
+        customers = [(i, f'Cust_{i}', 'City_'+str((i%10)+1)) for i in range(1, 201)]
+        cur.executemany("INSERT INTO customers(customer_id, name, city) VALUES (?, ?, ?);", customers)
+        # products
+        products = [(i, f'Prod_{i}', round(5.0 + (i % 20) * 1.5, 2)) for i in range(1, 501)]
+        cur.executemany("INSERT INTO products(product_id, name, price) VALUES (?, ?, ?);", products)
+        # orders
+        orders = []
+        oid = 1
+        for cust in range(1, 201):
+            # each customer has 1..5 orders
+            for j in range((cust % 5) + 1):
+                orders.append((oid, cust, f'2025-11-{(j%28)+1:02d}', 0.0))
+                oid += 1
+        cur.executemany("INSERT INTO orders(order_id, customer_id, order_date, total) VALUES (?, ?, ?, ?);", orders)
+        # order_items
+        if HAS_NUMPY:
+            # vectorized: each order has (order_id % 6) items
+            rng = np.random.default_rng(42)
+            order_nums = np.arange(1, oid)
+            order_ids = np.repeat(order_nums, order_nums % 6)
+            n_items = len(order_ids)
+            pids = rng.integers(1, 501, size=n_items)
+            qtys = rng.integers(1, 6, size=n_items)
+            prices = 5.0 + (pids % 20) * 1.5
+            order_items = zip(range(1, n_items + 1), order_ids.tolist(), pids.tolist(), qtys.tolist(), prices.tolist())
+        else:
+            order_items = []
+            oitem_id = 1
+            import random
+            random.seed(42)
+            for order in range(1, oid):
+                # each order has 1..6 items
+                for k in range(1, (order % 6) + 1):
+                    pid = random.randint(1, 500)
+                    qty = random.randint(1, 5)
+                    price = 5.0 + (pid % 20) * 1.5
+                    order_items.append((oitem_id, order, pid, qty, price))
+                    oitem_id += 1
+        cur.executemany("INSERT INTO order_items(order_item_id, order_id, product_id, quantity, unit_price) VALUES (?, ?, ?, ?, ?);", order_items)
+
+        # index the foreign key columns (before the UPDATE so its correlated
+        # subquery is an index lookup per order); join probes use them too
+        cur.execute("CREATE INDEX idx_orders_cust ON orders(customer_id)")
+        cur.execute("CREATE INDEX idx_items_order ON order_items(order_id)")
+        cur.execute("CREATE INDEX idx_items_prod ON order_items(product_id)")
+
+        # update orders.total
+        cur.execute("""
+            UPDATE orders
+            SET total = (
+                SELECT SUM(quantity * unit_price) FROM order_items WHERE order_items.order_id = orders.order_id
+            )
+        """)
     print("Sample DB created: customers(200), products(500), orders(~1000), order_items(~4000)")
 
 # ----------------------
 # SQL Parsing (joins, subqueries, tables)
 # ----------------------
+@functools.lru_cache(maxsize=256)
 def count_joins_and_subqueries(sql: str):
     """Return (join_count, subquery_count). Uses sqlparse if available, else heuristics."""
-    sql_up = sql.upper()
     # heuristic: count occurrences of ' JOIN ' ignoring inside strings
-    join_count = len(re.findall(r'\bJOIN\b', sql_up))
+    join_count = len(_JOIN_RE.findall(sql))
     # subquery heuristic: count 'SELECT' occurrences besides the first top-level one
     # More robust approach: count occurrences of '(' followed by SELECT
-    subquery_count = len(re.findall(r'\(\s*SELECT\b', sql, flags=re.IGNORECASE))
+    subquery_count = len(_SUBQ_RE.findall(sql))
     return join_count, subquery_count
 
+@functools.lru_cache(maxsize=256)
 def extract_table_names(sql: str):
     """
     Attempt to extract table names from FROM and JOIN clauses.
     If sqlparse is available, use tokens; else use regex heuristics.
-    Returns a list of table names (may include aliases).
+    Returns a tuple of distinct table names (may include aliases): FROM tables
+    first, then JOIN tables, each in order of appearance.
     """
-    tables = set()
+    tables: list[str] = []
+    seen: set[str] = set()
     if HAS_SQLPARSE:
+        import sqlparse
         parsed = sqlparse.parse(sql)
         for statement in parsed:
             from_seen = False
@@ -146,58 +239,88 @@ def extract_table_names(sql: str):
             # Use sqlparse utilities (flatten)
         # fallback to regex anyway (sqlparse parsing for full table name extraction is long)
     # regex to find FROM <table> and JOIN <table>
-    for match in re.finditer(r'\bFROM\s+([^\s,;]+)', sql, flags=re.IGNORECASE):
-        tables.add(clean_table_token(match.group(1)))
-    for match in re.finditer(r'\bJOIN\s+([^\s,;]+)', sql, flags=re.IGNORECASE):
-        tables.add(clean_table_token(match.group(1)))
-    return list(tables)
+    for pattern in (_FROM_RE, _JOIN_TBL_RE):
+        for match in pattern.finditer(sql):
+            name = clean_table_token(match.group(1))
+            if name not in seen:
+                seen.add(name)
+                tables.append(name)
+    return tuple(tables)
 
 def clean_table_token(token):
     """Clean table token by removing aliases and punctuation."""
     t = token.strip()
     # remove trailing commas
-    t = re.sub(r',$', '', t)
+    t = _TRAILING_COMMA_RE.sub('', t)
     # if token contains AS or alias, take first part
-    t = re.split(r'\s+AS\s+|\s+', t, flags=re.IGNORECASE)[0]
+    t = _ALIAS_SPLIT_RE.split(t)[0]
     # remove parentheses
     t = t.strip('()')
     return t
 
+@functools.lru_cache(maxsize=256)
 def extract_subqueries(sql: str):
-    """Return list of subquery strings found (very simple heuristic using balanced parentheses)."""
-    subs = []
-    # find '( SELECT ... )' capturing balanced parentheses roughly
-    pattern = re.compile(r'\(\s*SELECT', flags=re.IGNORECASE)
-    for m in pattern.finditer(sql):
-        start = m.start()
-        # find matching closing parenthesis naive parse
-        depth = 0
-        i = start
-        while i < len(sql):
-            if sql[i] == '(':
-                depth += 1
-            elif sql[i] == ')':
-                depth -= 1
-                if depth == 0:
-                    subs.append(sql[start:i+1])
-                    break
-            i += 1
-    return subs
+    """Return tuple of subquery strings found (very simple heuristic using balanced parentheses)."""
+    spans = []
+    # single pass: stack holds the start of each open '(' (None if it isn't a '( SELECT');
+    # str.find jumps straight between parentheses instead of visiting every character
+    starts = []
+    lp = sql.find('(')
+    rp = sql.find(')')
+    while lp != -1 or rp != -1:
+        if lp != -1 and (rp == -1 or lp < rp):
+            starts.append(lp if _SUBQ_RE.match(sql, lp) else None)
+            lp = sql.find('(', lp + 1)
+        else:
+            if starts:
+                start = starts.pop()
+                if start is not None:
+                    spans.append((start, rp + 1))
+            rp = sql.find(')', rp + 1)
+    # nested subqueries close first; report them in order of appearance
+    spans.sort()
+    return tuple(sql[a:b] for a, b in spans)
+
+def clear_parse_caches():
+    """Clear the memoized parse results (useful when testing/debugging the parsers)."""
+    count_joins_and_subqueries.cache_clear()
+    extract_table_names.cache_clear()
+    extract_subqueries.cache_clear()
 
 # ----------------------
 # Analyzer: EXPLAIN + timing
 # ----------------------
-def explain_query_plan(conn, sql):
-    """Run EXPLAIN QUERY PLAN and return rows."""
-    cur = conn.cursor()
-    try:
-        cur.execute("EXPLAIN QUERY PLAN " + sql)
-        rows = cur.fetchall()
+def _explain_cached(conn, sql):
+    """EXPLAIN QUERY PLAN memoized per connection and schema version; failures are not cached."""
+    cache = _conn_cache(_explain_cache, conn)
+    rows = cache.get(sql)
+    if rows is None:
+        rows = conn.execute("EXPLAIN QUERY PLAN " + sql).fetchall()
         # rows are tuples (id, parent, notused, detail) or text depending on sqlite version
-        return rows
+        rows = tuple(tuple(r) for r in rows)
+        if len(cache) >= _EXPLAIN_CACHE_SIZE:
+            # evict the oldest plan (dicts keep insertion order)
+            del cache[next(iter(cache))]
+        cache[sql] = rows
+    return rows
+
+def _explain_cache_clear():
+    """Forget all cached query plans."""
+    _explain_cache.clear()
+
+def explain_query_plan(conn, sql, report_errors=False):
+    """
+    Run EXPLAIN QUERY PLAN and return rows (as a tuple of tuples).
+    On failure the error is printed and no rows are returned, or with report_errors
+    a single ("EXPLAIN FAILED", message) row is returned instead.
+    """
+    try:
+        return _explain_cached(conn, sql)
     except sqlite3.DatabaseError as e:
+        if report_errors:
+            return (("EXPLAIN FAILED", str(e)),)
         print("EXPLAIN failed:", e)
-        return []
+        return ()
 
 def time_query(conn, sql, warmup=True, iterations=1):
     """Time execution of SQL. Returns elapsed seconds and optionally result count."""
@@ -209,12 +332,15 @@ def time_query(conn, sql, warmup=True, iterations=1):
             cur.fetchall()
         except Exception:
             pass
+    # bind the cursor methods once so the timed loop doesn't re-resolve them
+    _execute = cur.execute
+    _fetchall = cur.fetchall
     start = time.perf_counter()
     results = None
     try:
         for _ in range(iterations):
-            cur.execute(sql)
-            results = cur.fetchall()
+            _execute(sql)
+            results = _fetchall()
     except Exception as e:
         # Could be invalid fragment (we'll capture as zero time and note error)
         return None, str(e)
@@ -242,38 +368,101 @@ def estimate_table_costs(conn, tables):
             costs[t] = None
     return costs
 
-def estimate_join_cost(conn, left_table, right_table, join_condition=None):
+def invalidate_schema_cache(conn):
     """
-    Estimate cost of joining two tables by executing a small join with LIMIT.
-    join_condition can be provided like 'left.col = right.col' or will guess on common names.
+    Drop cached PRAGMA results and query plans for conn. Schema changes are detected
+    automatically; this is only needed to force a refresh.
     """
-    # Build best-effort join SQL
-    base_left = left_table
-    base_right = right_table
-    # attempt to find common column names (id-based) by querying PRAGMA table_info
-    cur = conn.cursor()
     try:
-        left_cols = [r[1] for r in cur.execute(f"PRAGMA table_info({base_left})").fetchall()]
-        right_cols = [r[1] for r in cur.execute(f"PRAGMA table_info({base_right})").fetchall()]
+        _fk_cache.pop(conn, None)
+        _explain_cache.pop(conn, None)
+    except TypeError:
+        pass
+
+def _primary_key_column(conn, table):
+    """Return the name of table's single-column primary key, or None if it has none or a composite one."""
+    try:
+        rows = conn.execute(f"PRAGMA table_info({table})").fetchall()
     except Exception:
-        left_cols = []
-        right_cols = []
-    common = set(left_cols).intersection(set(right_cols))
+        return None
+    # rows are (cid, name, type, notnull, dflt_value, pk); pk > 0 marks primary key columns
+    pk_cols = [r[1] for r in rows if r[5]]
+    return pk_cols[0] if len(pk_cols) == 1 else None
+
+def _get_fks(conn, table, cache):
+    """
+    Return [(column, parent_table, parent_column)] for table, running the PRAGMAs only on a cache miss.
+    parent_column is None when it can't be determined (the FK names only the parent table and
+    the parent has no single-column primary key).
+    """
+    fks = cache.get(table)
+    if fks is None:
+        try:
+            rows = conn.execute(f"PRAGMA foreign_key_list({table})").fetchall()
+        except Exception:
+            rows = []
+        # rows are (id, seq, table, from, to, on_update, on_delete, match);
+        # 'to' is NULL for 'REFERENCES parent' without a column, meaning the parent's primary key
+        fks = [(r[3], r[2], r[4] if r[4] is not None else _primary_key_column(conn, r[2])) for r in rows]
+        cache[table] = fks
+    return fks
+
+def get_foreign_keys(conn, tables):
+    """
+    Look up declared foreign keys for each table (cached per connection until its schema changes).
+    Returns dict table -> list of (column, parent_table, parent_column).
+    """
+    cache = _conn_cache(_fk_cache, conn)
+    return {t: _get_fks(conn, t, cache) for t in tables}
+
+def find_join_key(foreign_keys, left_table, right_table):
+    """
+    Find the FK relationship between two tables in either direction.
+    Returns (child, parent, child_col, parent_col) or None if they are unrelated
+    (FKs whose parent column is unknown are skipped rather than guessed).
+    """
+    for child, parent in ((left_table, right_table), (right_table, left_table)):
+        for col, ref_table, ref_col in foreign_keys.get(child, []):
+            if ref_col is not None and ref_table.lower() == parent.lower():
+                return child, parent, col, ref_col
+    return None
+
+def estimate_join_cost(conn, left_table, right_table, join_condition=None, foreign_keys=None, join_key=None):
+    """
+    Estimate cost of joining two tables by executing a COUNT(*) over their join.
+    join_condition can be provided like 'left.col = right.col'; otherwise the join
+    follows the declared foreign key so SQLite can use the index on it. Callers that
+    already ran find_join_key can pass its result as join_key to skip the lookup.
+    Returns None when the tables have no FK relationship (no cross join is attempted).
+    """
     if join_condition:
-        cond = join_condition
-    elif common:
-        c = next(iter(common))
-        cond = f"{base_left}.{c} = {base_right}.{c}"
-    else:
-        # fallback - do cross join but limit rows
-        cond = None
-    if cond:
-        sql = f"SELECT COUNT(*) FROM {base_left} JOIN {base_right} ON {cond}"
+        sql = f"SELECT COUNT(*) FROM {left_table} JOIN {right_table} ON {join_condition}"
     else:
-        sql = f"SELECT COUNT(*) FROM {base_left}, {base_right} LIMIT 1000"
+        key = join_key
+        if key is None:
+            if foreign_keys is None:
+                foreign_keys = get_foreign_keys(conn, (left_table, right_table))
+            key = find_join_key(foreign_keys, left_table, right_table)
+        if key is None:
+            return None
+        child, parent, col, ref_col = key
+        if col == ref_col:
+            sql = f"SELECT COUNT(*) FROM {child} JOIN {parent} USING({col})"
+        else:
+            sql = f"SELECT COUNT(*) FROM {child} JOIN {parent} ON {child}.{col} = {parent}.{ref_col}"
     dur, _ = time_query(conn, sql)
     return dur
 
+def join_pairs(tables):
+    """
+    Return (pairs, sampled): every unordered pair of tables, or for queries touching
+    more than MAX_PAIRWISE_TABLES tables only the first table paired with each other one
+    (the join costs are only displayed, so a linear sample keeps wide queries cheap).
+    """
+    if len(tables) > MAX_PAIRWISE_TABLES:
+        return [(tables[0], t) for t in tables[1:]], True
+    return [(tables[i], tables[j]) for i in range(len(tables)) for j in range(i+1, len(tables))], False
+
 # ----------------------
 # High-level analyze function
 # ----------------------
@@ -293,7 +482,7 @@ def analyze_query(conn, sql):
     report['subquery_count'] = subquery_count
 
     tables = extract_table_names(sql)
-    report['tables'] = tables
+    report['tables'] = list(tables)
 
     report['explain'] = explain_query_plan(conn, sql)
 
@@ -307,43 +496,52 @@ def analyze_query(conn, sql):
     # Add explain steps to timeline (if present)
     for row in report['explain']:
         # row may be different shapes; convert to str
-        timeline.append(Step(name=str(row), type="explain_step", duration_s=0.0, detail=str(row))._asdict())
+        timeline.append({"name": str(row), "type": "explain_step", "duration_s": 0.0, "detail": str(row)})
 
     # Per-table estimates
     print("Estimating per-table costs...")
     table_costs = estimate_table_costs(conn, tables)
     for t, d in table_costs.items():
-        timeline.append(Step(name=f"Table scan: {t}", type="table_scan", duration_s=d or 0.0, detail="COUNT(*) estimate")._asdict())
+        timeline.append({"name": f"Table scan: {t}", "type": "table_scan", "duration_s": d or 0.0, "detail": "COUNT(*) estimate"})
 
-    # For join pairs, estimate join cost (attempt for each pair)
+    # For join pairs, estimate join cost (only pairs related by a foreign key)
     join_costs = {}
-    if len(tables) >= 2:
+    pairs, sampled = join_pairs(tables)
+    report['join_pairs_sampled'] = sampled
+    if pairs:
         print("Estimating join costs (pairwise)...")
-        for i in range(len(tables)):
-            for j in range(i+1, len(tables)):
-                left = tables[i]
-                right = tables[j]
-                dur = estimate_join_cost(conn, left, right)
-                key = f"{left}<> {right}"
-                join_costs[key] = dur
-                timeline.append(Step(name=f"Join {left} ⨝ {right}", type="join", duration_s=dur or 0.0, detail="pairwise join COUNT(*)")._asdict())
+        foreign_keys = get_foreign_keys(conn, tables)
+        for left, right in pairs:
+            join_key = find_join_key(foreign_keys, left, right)
+            if join_key is None:
+                continue
+            dur = estimate_join_cost(conn, left, right, join_key=join_key)
+            key = f"{left}<> {right}"
+            join_costs[key] = dur
+            timeline.append({"name": f"Join {left} ⨝ {right}", "type": "join", "duration_s": dur or 0.0, "detail": "pairwise join COUNT(*)"})
 
     # Subqueries: extract and time each
     subqueries = extract_subqueries(sql)
     subq_costs = {}
     if subqueries:
         print("Timing subqueries...")
-        for idx, sub in enumerate(subqueries, start=1):
-            # Remove surrounding parentheses
-            ssql = sub.strip()
-            if ssql[0] == '(' and ssql[-1] == ')':
-                ssql = ssql[1:-1]
-            dur, _ = time_query(conn, ssql)
-            subq_costs[f"subquery_{idx}"] = dur
-            timeline.append(Step(name=f"Subquery {idx}", type="subquery", duration_s=dur or 0.0, detail=ssql[:200])._asdict())
+        # run all subquery timings inside one transaction instead of one per statement
+        own_txn = not conn.in_transaction
+        if own_txn:
+            conn.execute("BEGIN")
+        try:
+            for idx, sub in enumerate(subqueries, start=1):
+                # Remove surrounding parentheses
+                ssql = _OUTER_PARENS_RE.sub('', sub)
+                dur, _ = time_query(conn, ssql)
+                subq_costs[f"subquery_{idx}"] = dur
+                timeline.append({"name": f"Subquery {idx}", "type": "subquery", "duration_s": dur or 0.0, "detail": ssql[:200]})
+        finally:
+            if own_txn:
+                conn.execute("COMMIT")
 
     # Whole query step
-    timeline.append(Step(name="Full query execution", type="query", duration_s=full_dur or 0.0, detail=sql[:400])._asdict())
+    timeline.append({"name": "Full query execution", "type": "query", "duration_s": full_dur or 0.0, "detail": sql[:400]})
 
     # Sort timeline by duration desc for bottleneck identification
     timeline_sorted = sorted(timeline, key=lambda s: (s['duration_s'] if s['duration_s'] is not None else 0.0), reverse=True)
@@ -372,6 +570,9 @@ def print_report(report):
     print(f"Subquery count: {report.get('subquery_count')}")
     print("Tables:", report.get('tables'))
     print(f"Full query duration (s): {report.get('full_query_duration_s')}")
+    if report.get('join_pairs_sampled'):
+        print(f"Note: more than {MAX_PAIRWISE_TABLES} tables, join probes sampled against the first table only; "
+              "join bottleneck ranking is approximate.")
     print("\nTop timeline steps (sorted by measured duration):")
     timeline = report.get('timeline', [])[:10]
     for step in timeline:
@@ -385,9 +586,20 @@ def print_report(report):
         print("  ", r)
     print("\n(Report also saved to sql_analysis_report.json)")
 
+def write_json(obj, filename, indent=2):
+    """
+    Write obj to filename as UTF-8 JSON; non-serializable values are written via str().
+    Uses orjson when available (which always indents by 2), else the stdlib json module.
+    """
+    if HAS_ORJSON:
+        with open(filename, "wb") as f:
+            f.write(orjson.dumps(obj, option=orjson.OPT_INDENT_2, default=str))
+    else:
+        with open(filename, "w", encoding="utf-8") as f:
+            json.dump(obj, f, indent=indent, ensure_ascii=False, default=str)
+
 def save_report(report, filename="sql_analysis_report.json"):
-    with open(filename, "w") as f:
-        json.dump(report, f, indent=2, default=str)
+    write_json(report, filename)
     print(f"Saved report to {filename}")
 
 # ----------------------
@@ -395,7 +607,7 @@ def save_report(report, filename="sql_analysis_report.json"):
 # ----------------------
 if __name__ == "__main__":
     # Connect to in-memory sqlite (or change to a file db)
-    conn = sqlite3.connect(":memory:")
+    conn = connect_db(":memory:")
     create_sample_db(conn)
 
     # Example query (you can replace this with your query)
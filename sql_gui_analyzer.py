@@ -1,218 +1,90 @@
 import tkinter as tk
 from tkinter import scrolledtext, messagebox
-import sqlite3
-import time
-import re
-import json
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
+import threading
+import queue
+
+# Analysis helpers (and their caches) are shared with the command-line analyzer
+from sql_analyzer import (
+    connect_db,
+    create_sample_db,
+    count_joins_and_subqueries,
+    extract_table_names as extract_tables,
+    explain_query_plan as explain_query,
+    time_query,
+    estimate_table_costs,
+    get_foreign_keys,
+    find_join_key,
+    join_pairs,
+    MAX_PAIRWISE_TABLES,
+    estimate_join_cost,
+    write_json,
+)
 
 
 # -----------------------------------------------------------
-# SAMPLE DATABASE CREATION
-# -----------------------------------------------------------
-def create_sample_db(conn):
-    cur = conn.cursor()
-    cur.executescript("""
-        DROP TABLE IF EXISTS customers;
-        DROP TABLE IF EXISTS products;
-        DROP TABLE IF EXISTS orders;
-        DROP TABLE IF EXISTS order_items;
-
-        CREATE TABLE customers (
-            customer_id INTEGER PRIMARY KEY,
-            name TEXT,
-            city TEXT
-        );
-
-        CREATE TABLE products (
-            product_id INTEGER PRIMARY KEY,
-            name TEXT,
-            price REAL
-        );
-
-        CREATE TABLE orders (
-            order_id INTEGER PRIMARY KEY,
-            customer_id INTEGER,
-            order_date TEXT,
-            total REAL
-        );
-
-        CREATE TABLE order_items (
-            order_item_id INTEGER PRIMARY KEY,
-            order_id INTEGER,
-            product_id INTEGER,
-            quantity INTEGER,
-            unit_price REAL
-        );
-    """)
-
-    # Insert sample data
-    customers = [(i, f'Cust_{i}', f'City_{i%5}') for i in range(1, 51)]
-    cur.executemany("INSERT INTO customers VALUES (?, ?, ?)", customers)
-
-    products = [(i, f'Prod_{i}', (i % 20) + 5) for i in range(1, 101)]
-    cur.executemany("INSERT INTO products VALUES (?, ?, ?)", products)
-
-    orders = [(i, (i % 50) + 1, "2025-11-01", 0) for i in range(1, 201)]
-    cur.executemany("INSERT INTO orders VALUES (?, ?, ?, ?)", orders)
-
-    item_data = []
-    import random
-    oid = 1
-    for o in range(1, 201):
-        for _ in range(random.randint(1, 5)):
-            pid = random.randint(1, 100)
-            qty = random.randint(1, 5)
-            price = (pid % 20) + 5
-            item_data.append((oid, o, pid, qty, price))
-            oid += 1
-
-    cur.executemany("INSERT INTO order_items VALUES (?, ?, ?, ?, ?)", item_data)
-
-    cur.execute("""
-        UPDATE orders
-        SET total = (SELECT SUM(quantity * unit_price)
-                     FROM order_items oi WHERE oi.order_id = orders.order_id)
-    """)
-
-    conn.commit()
-
-
-# -----------------------------------------------------------
-# ANALYSIS HELPERS
+# PDF GENERATION
 # -----------------------------------------------------------
-def count_joins_and_subqueries(sql):
-    return (
-        len(re.findall(r"\bJOIN\b", sql.upper())),
-        len(re.findall(r"\(\s*SELECT", sql.upper()))
-    )
-
-
-def extract_tables(sql):
-    tables = set()
-    tables.update(re.findall(r"FROM\s+([^\s;]+)", sql, re.IGNORECASE))
-    tables.update(re.findall(r"JOIN\s+([^\s;]+)", sql, re.IGNORECASE))
-    return list(tables)
-
-
-def explain_query(conn, sql):
-    cur = conn.cursor()
-    try:
-        cur.execute("EXPLAIN QUERY PLAN " + sql)
-        return cur.fetchall()
-    except Exception as e:
-        return [("EXPLAIN FAILED", str(e))]
-
-
-def time_query(conn, sql):
-    cur = conn.cursor()
-    start = time.time()
-    try:
-        cur.execute(sql)
-        cur.fetchall()
-        return time.time() - start, None
-    except Exception as e:
-        return None, str(e)
+def fmt_duration(duration):
+    # None means the probe failed, as opposed to a measured (near) zero
+    return "n/a" if duration is None else f"{duration:.6f}s"
 
 
-def table_scan_time(conn, table):
-    cur = conn.cursor()
-    try:
-        start = time.time()
-        cur.execute(f"SELECT COUNT(*) FROM {table}")
-        cur.fetchall()
-        return time.time() - start
-    except:
-        return 0
-
-
-def join_cost(conn, t1, t2):
-    cur = conn.cursor()
-    try:
-        start = time.time()
-        cur.execute(f"SELECT COUNT(*) FROM {t1}, {t2} LIMIT 2000")
-        cur.fetchall()
-        return time.time() - start
-    except:
-        return 0
-
-
-# -----------------------------------------------------------
-# PDF GENERATION
-# -----------------------------------------------------------
 def generate_pdf(report_text, timeline, explain_rows):
+    # reportlab is heavy to import; load it only when a PDF is actually written
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib.styles import ParagraphStyle
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Preformatted, PageBreak
 
-    c = canvas.Canvas("analysis_report.pdf", pagesize=letter)
-    width, height = letter
-
-    y = height - 50
-    c.setFont("Helvetica-Bold", 16)
-    c.drawString(50, y, "SQL Query Analysis Report")
-    y -= 40
-
-    c.setFont("Helvetica", 9)
-
-    # Write report text
-    for line in report_text.split("\n"):
-        if y < 40:
-            c.showPage()
-            c.setFont("Helvetica", 9)
-            y = height - 50
-        c.drawString(50, y, line)
-        y -= 15
-
-    c.showPage()
-    c.setFont("Helvetica-Bold", 12)
-    c.drawString(50, height - 50, "Execution Timeline (Sorted)")
-    y = height - 80
-    c.setFont("Helvetica", 9)
-
-    for t in timeline:
-        line = f"{t['type']} | {t['name']} | {t['duration']:.6f}s"
-        if y < 40:
-            c.showPage()
-            y = height - 50
-            c.setFont("Helvetica", 9)
-        c.drawString(50, y, line)
-        y -= 15
-
-    c.showPage()
-    c.setFont("Helvetica-Bold", 12)
-    c.drawString(50, height - 50, "EXPLAIN QUERY PLAN")
-    y = height - 80
-    c.setFont("Helvetica", 9)
+    # Platypus lays out and paginates the flowables itself
+    doc = SimpleDocTemplate("analysis_report.pdf", pagesize=letter,
+                            leftMargin=50, rightMargin=50, topMargin=50, bottomMargin=40)
 
-    for r in explain_rows:
-        if y < 40:
-            c.showPage()
-            y = height - 50
-        c.drawString(50, y, str(r))
-        y -= 15
+    title = ParagraphStyle("ReportTitle", fontName="Helvetica-Bold", fontSize=16, leading=40)
+    heading = ParagraphStyle("ReportHeading", fontName="Helvetica-Bold", fontSize=12, leading=30)
+    body = ParagraphStyle("ReportBody", fontName="Helvetica", fontSize=9, leading=15)
 
-    c.save()
+    timeline_text = "\n".join(
+        f"{t['type']} | {t['name']} | {fmt_duration(t['duration'])}" for t in timeline
+    )
+    explain_text = "\n".join(str(r) for r in explain_rows)
+
+    # Preformatted keeps the report's column alignment and needs no markup escaping
+    story = [
+        Paragraph("SQL Query Analysis Report", title),
+        Preformatted(report_text, body),
+        PageBreak(),
+        Paragraph("Execution Timeline (Sorted)", heading),
+        Preformatted(timeline_text, body),
+        PageBreak(),
+        Paragraph("EXPLAIN QUERY PLAN", heading),
+        Preformatted(explain_text, body),
+    ]
+    doc.build(story)
 
 
 # -----------------------------------------------------------
 # REPORT TEXT BUILDER
 # -----------------------------------------------------------
-def generate_report(sql, joins, subs, tables, exec_time, explain_rows, timeline_sorted, bottlenecks):
+def generate_report(sql, joins, subs, tables, exec_time, explain_rows, timeline_sorted, bottlenecks, sampled=False):
     report = []
     report.append("=== SQL ANALYSIS REPORT ===")
     report.append(f"Join count: {joins}")
     report.append(f"Subquery count: {subs}")
     report.append(f"Tables: {tables}")
     report.append(f"Full query duration (s): {exec_time:.6f}")
+    if sampled:
+        report.append(f"Note: more than {MAX_PAIRWISE_TABLES} tables, join probes sampled against the first table only; "
+                      "join bottleneck ranking is approximate.")
 
     report.append("\nTop timeline steps (sorted by measured duration):")
     for step in timeline_sorted[:10]:
         report.append(
-            f" - {step['type']:10s} | {step['name'][:60]:60s} | {step['duration']:.6f}s"
+            f" - {step['type']:10s} | {step['name'][:60]:60s} | {fmt_duration(step['duration'])}"
         )
 
     report.append("\nBottlenecks:")
     for b in bottlenecks:
-        report.append(f" * {b['type']} - {b['name']} : {b['duration']:.6f}s")
+        report.append(f" * {b['type']} - {b['name']} : {fmt_duration(b['duration'])}")
 
     report.append("\nEXPLAIN QUERY PLAN (raw):")
     for r in explain_rows:
@@ -224,38 +96,42 @@ def generate_report(sql, joins, subs, tables, exec_time, explain_rows, timeline_
 # -----------------------------------------------------------
 # MAIN GUI LOGIC
 # -----------------------------------------------------------
-def analyze_sql():
-    sql = sql_input.get("1.0", tk.END).strip()
-    if not sql:
-        messagebox.showerror("Error", "Please enter SQL query.")
-        return
+# Worker thread -> Tk thread hand-off: (status, text) tuples
+results = queue.Queue()
 
+
+def run_analysis(sql):
+    # Runs on the worker thread: no Tk calls here, only SQLite work and file output
     joins, subs = count_joins_and_subqueries(sql)
-    tables = extract_tables(sql)
-    explain_rows = explain_query(conn, sql)
-    exec_time, error = time_query(conn, sql)
+    tables = list(extract_tables(sql))
+    explain_rows = explain_query(conn, sql, report_errors=True)
+    # no warmup run: the user's statement may modify data and must execute exactly once
+    exec_time, result = time_query(conn, sql, warmup=False)
 
-    if error:
-        messagebox.showerror("SQL Error", error)
-        return
+    if exec_time is None:
+        # on failure time_query returns the error message in place of the rows
+        return "sql_error", result
 
     timeline = []
 
-    for t in tables:
+    for t, duration in estimate_table_costs(conn, tables).items():
         timeline.append({
             "name": f"Table scan: {t}",
             "type": "table_scan",
-            "duration": table_scan_time(conn, t)
+            "duration": duration
         })
 
-    for i in range(len(tables)):
-        for j in range(i + 1, len(tables)):
-            t1, t2 = tables[i], tables[j]
-            timeline.append({
-                "name": f"Join {t1} ⨝ {t2}",
-                "type": "join",
-                "duration": join_cost(conn, t1, t2)
-            })
+    fks = get_foreign_keys(conn, tables)
+    pairs, sampled = join_pairs(tables)
+    for t1, t2 in pairs:
+        key = find_join_key(fks, t1, t2)
+        if key is None:
+            continue
+        timeline.append({
+            "name": f"Join {t1} ⨝ {t2}",
+            "type": "join",
+            "duration": estimate_join_cost(conn, t1, t2, join_key=key)
+        })
 
     timeline.append({
         "name": "Full query execution",
@@ -263,38 +139,78 @@ def analyze_sql():
         "duration": exec_time
     })
 
-    timeline_sorted = sorted(timeline, key=lambda x: x["duration"], reverse=True)
-    bottlenecks = timeline_sorted[:5]
+    # failed probes (None) sort after every measured step
+    timeline_sorted = sorted(timeline, key=lambda x: (x["duration"] is not None, x["duration"] or 0.0), reverse=True)
+    bottlenecks = [step for step in timeline_sorted[:5] if step["duration"] is not None]
 
-    report_text = generate_report(sql, joins, subs, tables, exec_time, explain_rows, timeline_sorted, bottlenecks)
-
-    # Display in GUI
-    output_box.delete("1.0", tk.END)
-    output_box.insert(tk.END, report_text)
+    report_text = generate_report(sql, joins, subs, tables, exec_time, explain_rows, timeline_sorted, bottlenecks, sampled)
 
     # Save TXT (UTF-8 FIXED)
     with open("analysis_report.txt", "w", encoding="utf-8") as f:
         f.write(report_text)
 
     # Save JSON (UTF-8 FIXED)
-    with open("analysis_report.json", "w", encoding="utf-8") as f:
-        json.dump({
-            "sql": sql,
-            "join_count": joins,
-            "subquery_count": subs,
-            "tables": tables,
-            "execution_time": exec_time,
-            "timeline": timeline_sorted,
-            "bottlenecks": bottlenecks,
-            "explain": [str(r) for r in explain_rows]
-        }, f, indent=4, ensure_ascii=False)
+    write_json({
+        "sql": sql,
+        "join_count": joins,
+        "subquery_count": subs,
+        "tables": tables,
+        "execution_time": exec_time,
+        "join_pairs_sampled": sampled,
+        "timeline": timeline_sorted,
+        "bottlenecks": bottlenecks,
+        "explain": [str(r) for r in explain_rows]
+    }, "analysis_report.json", indent=4)
 
     # Save PDF
     generate_pdf(report_text, timeline_sorted, explain_rows)
 
+    return "ok", report_text
+
+
+def analysis_worker(sql):
+    try:
+        results.put(run_analysis(sql))
+    except Exception as e:
+        results.put(("error", str(e)))
+
+
+def check_results():
+    # Tk thread: poll for the worker's result instead of touching widgets from the worker
+    try:
+        status, text = results.get_nowait()
+    except queue.Empty:
+        root.after(50, check_results)
+        return
+
+    analyze_button.config(state=tk.NORMAL)
+
+    if status == "sql_error":
+        messagebox.showerror("SQL Error", text)
+        return
+    if status == "error":
+        messagebox.showerror("Error", text)
+        return
+
+    # Display in GUI
+    output_box.delete("1.0", tk.END)
+    output_box.insert(tk.END, text)
+
     messagebox.showinfo("Success", "Reports Generated:\n• analysis_report.txt\n• analysis_report.json\n• analysis_report.pdf")
 
 
+def analyze_sql():
+    sql = sql_input.get("1.0", tk.END).strip()
+    if not sql:
+        messagebox.showerror("Error", "Please enter SQL query.")
+        return
+
+    # one analysis at a time; re-enabled by check_results
+    analyze_button.config(state=tk.DISABLED)
+    threading.Thread(target=analysis_worker, args=(sql,), daemon=True).start()
+    root.after(50, check_results)
+
+
 # -----------------------------------------------------------
 # BUILD GUI INTERFACE
 # -----------------------------------------------------------
@@ -308,16 +224,17 @@ tk.Label(root, text="Enter SQL Query Below:").pack()
 sql_input = scrolledtext.ScrolledText(root, width=120, height=8)
 sql_input.pack(pady=5)
 
-tk.Button(root, text="Analyze Query",
-          font=("Arial", 12, "bold"),
-          bg="green", fg="white",
-          command=analyze_sql).pack(pady=10)
+analyze_button = tk.Button(root, text="Analyze Query",
+                           font=("Arial", 12, "bold"),
+                           bg="green", fg="white",
+                           command=analyze_sql)
+analyze_button.pack(pady=10)
 
 output_box = scrolledtext.ScrolledText(root, width=120, height=25)
 output_box.pack(pady=10)
 
-# Load sample DB
-conn = sqlite3.connect(":memory:")
+# Load sample DB (used from the analysis worker thread; one job runs at a time)
+conn = connect_db(":memory:", check_same_thread=False)
 create_sample_db(conn)
 
 root.mainloop()